@@ -3,51 +3,115 @@ import datetime
 import pandas as pd
 import requests
 import urllib.parse
+from typing import NamedTuple, Optional
+from concurrent.futures import ThreadPoolExecutor
 from geopy.geocoders import Nominatim
 
+try:
+    import orjson  # 選用：較快的 JSON 解析
+except ImportError:
+    orjson = None
+
 # --- 🛠️ 工具函式庫 ---
 
-def get_coordinates(place_name):
-    """取得地點座標 (用於查天氣與顯示確認地圖)"""
-    geolocator = Nominatim(user_agent="hiking_helper_lite")
+WEATHER_API_URL = "https://api.open-meteo.com/v1/forecast"
+
+@st.cache_resource
+def get_geolocator():
+    """共用 Nominatim 實例 (重複使用連線)"""
+    return Nominatim(user_agent="hiking_helper_lite")
+
+def get_http_session():
+    """每位使用者各自的 HTTP Session (keep-alive，省去重複 TLS 握手)"""
+    if 'http_session' not in st.session_state:
+        st.session_state.http_session = requests.Session()
+    return st.session_state.http_session
+
+def warm_up_weather_session(session):
+    """預先建立與 Open-Meteo 的連線 (與定位同時進行)"""
     try:
-        search_query = f"台灣 {place_name}"
+        session.head(WEATHER_API_URL, timeout=5)
+    except requests.RequestException:
+        pass
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def get_coordinates(place_name, _session):
+    """取得地點座標 (用於查天氣與顯示確認地圖)；連線錯誤直接拋出，避免被快取"""
+    geolocator = get_geolocator()
+    search_query = f"台灣 {place_name}"
+    # 只有快取未命中、真的要連網定位時，才同時先與天氣 API 建立連線
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        pool.submit(warm_up_weather_session, _session)
         location = geolocator.geocode(search_query, timeout=10)
-        if location:
-            return location.latitude, location.longitude, location.address
-        return None, None, None
-    except Exception:
-        return None, None, None
-
-def get_weather_forecast(lat, lon):
-    """查詢 Open-Meteo 天氣 (含日出日落)"""
-    url = "https://api.open-meteo.com/v1/forecast"
+    if location:
+        return location.latitude, location.longitude, location.address
+    return None, None, None
+
+@st.cache_data(ttl=900, show_spinner=False)
+def get_weather_forecast(lat, lon, _session):
+    """查詢 Open-Meteo 天氣 (含日出日落)，回傳 {欄位: 逐日數值}；失敗時拋出例外，避免被快取"""
     params = {
         "latitude": lat,
         "longitude": lon,
         "daily": ["temperature_2m_max", "temperature_2m_min", "precipitation_probability_max", "sunrise", "sunset"],
         "timezone": "Asia/Taipei"
     }
-    try:
-        response = requests.get(url, params=params)
-        data = response.json()
-        daily = data.get("daily", {})
-        df = pd.DataFrame({
-            "日期": daily.get("time"),
-            "最高溫": daily.get("temperature_2m_max"),
-            "最低溫": daily.get("temperature_2m_min"),
-            "降雨機率(%)": daily.get("precipitation_probability_max"),
-            "日出": daily.get("sunrise"),
-            "日落": daily.get("sunset")
-        })
-        return df
-    except Exception as e:
-        st.error(f"天氣資料讀取失敗: {e}")
-        return None
-
-def generate_full_details(mountain_name, route_name, date_obj, weather_info=None, custom_notes=""):
+    response = _session.get(WEATHER_API_URL, params=params, timeout=5)
+    response.raise_for_status()
+    data = orjson.loads(response.content) if orjson else response.json()
+    daily = data["daily"]
+    return {
+        "日期": [datetime.date.fromisoformat(d) for d in daily["time"]],
+        "最高溫": daily["temperature_2m_max"],
+        "最低溫": daily["temperature_2m_min"],
+        "降雨機率(%)": daily["precipitation_probability_max"],
+        "日出": daily["sunrise"],
+        "日落": daily["sunset"]
+    }
+
+def index_by_date(forecast):
+    """把逐欄的預報資料轉成 {日期: 當日各欄數值}"""
+    fields = [k for k in forecast if k != "日期"]
+    return {
+        day: dict(zip(fields, values))
+        for day, *values in zip(forecast["日期"], *(forecast[k] for k in fields))
+    }
+
+@st.cache_resource(max_entries=16, show_spinner=False)
+def get_point_df(lat, lon):
+    """地圖用的單點座標表 (依座標快取，直接共用同一物件，勿修改)"""
+    return pd.DataFrame({'lat': [lat], 'lon': [lon]})
+
+# 行事曆內容的固定區塊 (只組一次)
+_SEP = "\n" + "-" * 20 + "\n"
+_GEAR_BLOCK = "\n".join([
+    "\n【🎒 裝備檢查】",
+    "□ 證件 / 入山證 / 離線地圖",
+    "□ 頭燈 (含備用電池) ★重要",
+    "□ 雨具 / 保暖衣物",
+    "□ 行動水 / 行動糧",
+])
+_WINTER_TIP = "❄️ 冬季高山可能結冰，建議攜帶冰爪。"
+_PLUM_RAIN_TIP = "🌧️ 梅雨季節，注意午後雷陣雨。"
+_SUMMER_TIP = "🌪️ 颱風季/夏季，注意防曬與天氣警報。"
+_SEASON_TIPS = {
+    12: _WINTER_TIP, 1: _WINTER_TIP, 2: _WINTER_TIP, 3: _WINTER_TIP,
+    5: _PLUM_RAIN_TIP, 6: _PLUM_RAIN_TIP,
+    7: _SUMMER_TIP, 8: _SUMMER_TIP, 9: _SUMMER_TIP,
+}
+
+class WeatherInfo(NamedTuple):
+    """單日天氣摘要 (可雜湊，供 generate_full_details 快取)；API 缺值時欄位為 None"""
+    max_temp: Optional[float]
+    min_temp: Optional[float]
+    rain_prob: Optional[float]
+    sunrise: Optional[str]
+    sunset: Optional[str]
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def generate_full_details(mountain_name, encoded_name, route_name, date_obj, weather_info=None, custom_notes=""):
     """
-    🏭 行事曆內容工廠
+    🏭 行事曆內容工廠 (encoded_name 為已 URL 編碼的山名)
     """
     details = []
     
@@ -55,12 +119,12 @@ def generate_full_details(mountain_name, route_name, date_obj, weather_info=None
     if custom_notes:
         details.append("【📝 行程筆記】")
         details.append(custom_notes)
-        details.append("\n" + "-"*20 + "\n")
+        details.append(_SEP)
     
     # 2. 【導航連結】
-    map_url = f"https://www.google.com/maps/search/?api=1&query={urllib.parse.quote(mountain_name)}"
+    map_url = f"https://www.google.com/maps/search/?api=1&query={encoded_name}"
     details.append(f"📍 Google Maps 導航：{map_url}")
-    details.append("\n" + "-"*20 + "\n")
+    details.append(_SEP)
 
     # 3. 【天氣與資訊】
     details.append(f"【目的地】{mountain_name}")
@@ -68,40 +132,31 @@ def generate_full_details(mountain_name, route_name, date_obj, weather_info=None
         details.append(f"【路線】{route_name}")
     
     if weather_info:
-        max_t = weather_info.get('max_temp', '?')
-        min_t = weather_info.get('min_temp', '?')
-        rain = weather_info.get('rain_prob', 0)
-        sunrise = weather_info.get('sunrise', '未知')[-5:]
-        sunset = weather_info.get('sunset', '未知')[-5:]
+        max_t = weather_info.max_temp
+        min_t = weather_info.min_temp
+        rain = weather_info.rain_prob
+        sunrise = (weather_info.sunrise or '未知')[-5:]
+        sunset = (weather_info.sunset or '未知')[-5:]
         
         details.append("\n【☀️ 當日天氣預報】")
-        details.append(f"🌡️ 氣溫預測：{min_t}°C ~ {max_t}°C")
-        details.append(f"☔ 降雨機率：{rain}%")
+        details.append(f"🌡️ 氣溫預測：{'?' if min_t is None else min_t}°C ~ {'?' if max_t is None else max_t}°C")
+        details.append(f"☔ 降雨機率：{'?' if rain is None else rain}%")
         details.append(f"🌅 日出日落：{sunrise} / {sunset}")
         
-        if rain >= 30: details.append("⚠️ 降雨機率高，務必攜帶雨衣/雨褲！")
-        if min_t < 10: details.append("⚠️ 氣溫較低，請攜帶保暖中層。")
+        if rain is not None and rain >= 30: details.append("⚠️ 降雨機率高，務必攜帶雨衣/雨褲！")
+        if min_t is not None and min_t < 10: details.append("⚠️ 氣溫較低，請攜帶保暖中層。")
             
     else:
-        month = date_obj.month
         details.append("\n【☀️ 季節性氣候提醒】")
         details.append("⚠️ 日期較遠，暫無精準預報，請出發前 3 天再次確認。")
-        if month in [12, 1, 2, 3]:
-            details.append("❄️ 冬季高山可能結冰，建議攜帶冰爪。")
-        elif month in [5, 6]:
-            details.append("🌧️ 梅雨季節，注意午後雷陣雨。")
-        elif month in [7, 8, 9]:
-            details.append("🌪️ 颱風季/夏季，注意防曬與天氣警報。")
+        season_tip = _SEASON_TIPS.get(date_obj.month)
+        if season_tip:
+            details.append(season_tip)
     
     # 4. 【裝備檢查】
-    details.append("\n【🎒 裝備檢查】")
-    details.append("□ 證件 / 入山證 / 離線地圖")
-    details.append("□ 頭燈 (含備用電池) ★重要")
-    details.append("□ 雨具 / 保暖衣物")
-    details.append("□ 行動水 / 行動糧")
+    details.append(_GEAR_BLOCK)
     
     # 5. 【外部連結】
-    encoded_name = urllib.parse.quote(mountain_name)
     biji_link = f"https://hiking.biji.co/index.php?q={encoded_name}&node=search"
     details.append(f"\n🔗 健行筆記搜尋：{biji_link}")
 
@@ -112,9 +167,8 @@ def generate_full_details(mountain_name, route_name, date_obj, weather_info=None
 st.set_page_config(page_title="登山行程整合助手", page_icon="🏔️", layout="centered")
 
 # Session 初始化
-if 'weather_df' not in st.session_state: st.session_state.weather_df = None
-if 'searched_mountain' not in st.session_state: st.session_state.searched_mountain = ""
-if 'map_coords' not in st.session_state: st.session_state.map_coords = None
+for key, default in (('forecast_df', None), ('searched_mountain', ""), ('map_coords', None), ('weather_by_date', {})):
+    st.session_state.setdefault(key, default)
 
 st.title("🏔️ 登山行程整合助手")
 
@@ -140,17 +194,33 @@ with c2:
 
 if btn_search and search_input:
     with st.spinner(f"正在定位「{search_input}」..."):
-        lat, lon, addr = get_coordinates(search_input)
+        session = get_http_session()
+        geocode_failed = False
+        try:
+            lat, lon, addr = get_coordinates(search_input, session)
+        except Exception:
+            lat, lon, addr = None, None, None
+            geocode_failed = True
         
         if lat:
             st.session_state.map_coords = (lat, lon)
             st.session_state.searched_mountain = search_input
-            df = get_weather_forecast(lat, lon)
-            if df is not None:
-                st.session_state.weather_df = df
+            # 座標取到小數第 3 位，鄰近山頭可共用快取
+            try:
+                forecast = get_weather_forecast(round(lat, 3), round(lon, 3), session)
+            except Exception as e:
+                st.error(f"天氣資料讀取失敗: {e}")
+                forecast = None
+            if forecast is not None:
+                # 圖表用的 DataFrame 每次查詢只建一次，重跑頁面時直接沿用
+                st.session_state.forecast_df = pd.DataFrame(forecast)
+                # 以日期為索引預先建表，送出行程時直接查詢
+                st.session_state.weather_by_date = index_by_date(forecast)
                 st.success(f"📍 定位成功：{addr}")
             else:
                 st.warning("定位成功但查無天氣資料。")
+        elif geocode_failed:
+            st.error("❌ 定位服務暫時無法連線，請稍後再試。")
         else:
             st.error("❌ 找不到此地點，請嘗試縮短名稱。")
 
@@ -158,20 +228,20 @@ if st.session_state.map_coords:
     lat, lon = st.session_state.map_coords
     
     with st.expander("🗺️ 確認定位位置 (點此展開地圖)", expanded=True):
-        st.map(pd.DataFrame({'lat': [lat], 'lon': [lon]}), zoom=12)
+        st.map(get_point_df(lat, lon), zoom=12)
         if not ("台灣" in str(st.session_state.searched_mountain) or 21 < lat < 26):
             st.warning("⚠️ 定位點似乎不在台灣本島，請確認關鍵字。")
 
-    if st.session_state.weather_df is not None:
-        df = st.session_state.weather_df
+    if st.session_state.forecast_df is not None:
+        df = st.session_state.forecast_df
         tab1, tab2 = st.tabs(["🌡️ 氣溫走勢", "☔ 降雨機率"])
         with tab1: st.line_chart(df.set_index("日期")[["最高溫", "最低溫"]], color=["#FF5555", "#55AAFF"])
         with tab2: st.bar_chart(df.set_index("日期")["降雨機率(%)"], color="#0000FF")
 
         with st.expander("🌅 查看每日日出日落時刻"):
             display_df = df[["日期", "日出", "日落", "降雨機率(%)"]].copy()
-            display_df["日出"] = display_df["日出"].apply(lambda x: x[-5:] if x else "-")
-            display_df["日落"] = display_df["日落"].apply(lambda x: x[-5:] if x else "-")
+            display_df["日出"] = display_df["日出"].str.slice(-5).replace("", "-").fillna("-")
+            display_df["日落"] = display_df["日落"].str.slice(-5).replace("", "-").fillna("-")
             st.dataframe(display_df, use_container_width=True)
 
 st.divider()
@@ -212,21 +282,20 @@ with st.form("confirm_form"):
 
 if submitted and target_name:
     st.success(f"已建立行程：**{target_name}**")
+    quoted_name = urllib.parse.quote(target_name)
     
-    selected_date_str = hiking_date.strftime("%Y-%m-%d")
     day_weather_info = None
-    if st.session_state.weather_df is not None:
-        day_row = st.session_state.weather_df[st.session_state.weather_df["日期"] == selected_date_str]
-        if not day_row.empty:
-            day_weather_info = {
-                'max_temp': day_row.iloc[0]['最高溫'],
-                'min_temp': day_row.iloc[0]['最低溫'],
-                'rain_prob': day_row.iloc[0]['降雨機率(%)'],
-                'sunrise': day_row.iloc[0]['日出'],
-                'sunset': day_row.iloc[0]['日落']
-            }
+    row = st.session_state.weather_by_date.get(hiking_date)
+    if row:
+        day_weather_info = WeatherInfo(
+            max_temp=row['最高溫'],
+            min_temp=row['最低溫'],
+            rain_prob=row['降雨機率(%)'],
+            sunrise=row['日出'],
+            sunset=row['日落']
+        )
             
-    details_text = generate_full_details(target_name, route_name, hiking_date, day_weather_info, custom_notes)
+    details_text = generate_full_details(target_name, quoted_name, route_name, hiking_date, day_weather_info, custom_notes)
     
     if route_name:
         cal_title = f"⛰️ {target_name} - {route_name}"
@@ -245,8 +314,8 @@ if submitted and target_name:
         "location": target_name,
         "details": details_text
     }
-    cal_url = f"{cal_base}&{urllib.parse.urlencode(cal_params)}"
-    map_url = f"https://www.google.com/maps/search/?api=1&query={urllib.parse.quote(target_name)}"
+    cal_url = f"{cal_base}&{urllib.parse.urlencode(cal_params, quote_via=urllib.parse.quote)}"
+    map_url = f"https://www.google.com/maps/search/?api=1&query={quoted_name}"
 
     col_btn1, col_btn2 = st.columns(2)
     with col_btn1: